@@ -0,0 +1,16 @@
+"""
+Celery application for bothub.
+
+Workers are started with ``celery -A bothub worker``. Settings prefixed with
+``CELERY_`` in bothub/settings.py configure the app.
+"""
+
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bothub.settings')
+
+app = Celery("bothub")
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 
 import os
 import secrets
+import sys
 from pathlib import Path
 
 from django.core.exceptions import ImproperlyConfigured
@@ -126,6 +127,19 @@ else:
     }
 
 
+# Shared cache (e.g. redis://localhost:6379/1). Webhook bookkeeping -- the active
+# webhook list, delivery dedupe and batch windows -- must be visible to every web
+# and worker process; without CACHE_URL each process has its own memory cache.
+CACHE_URL = os.getenv("CACHE_URL", "")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -144,6 +158,11 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# `manage.py test` only needs hashes that round-trip, not slow ones.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == "test"
+if TESTING:
+    PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.0/topics/i18n/
@@ -196,6 +215,23 @@ AUTHENTICATION_BACKENDS = [
 ]
 
 WEBHOOK_TIMEOUT_SECONDS = int(os.getenv("WEBHOOK_TIMEOUT_SECONDS", "5"))
+WEBHOOK_CELERY_QUEUE = os.getenv("WEBHOOK_CELERY_QUEUE", "webhooks")
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "8"))
+# "sha256" (HMAC-SHA256) or "blake2b" (keyed BLAKE2b); sent as X-BotHub-Signature-Alg.
+WEBHOOK_SIGNATURE_ALG = os.getenv("WEBHOOK_SIGNATURE_ALG", "sha256")
+# Seconds to coalesce events per webhook into one POST; 0 sends each event on its own.
+WEBHOOK_BATCH_WINDOW_SECONDS = float(os.getenv("WEBHOOK_BATCH_WINDOW_SECONDS", "0"))
+
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "")
+# Without a broker, run tasks inline so dev and tests need no worker.
+CELERY_TASK_ALWAYS_EAGER = not CELERY_BROKER_URL
+CELERY_TASK_SERIALIZER = "json"
+CELERY_ACCEPT_CONTENT = ["json"]
+TASK_TREE_CACHE_SECONDS = int(os.getenv("TASK_TREE_CACHE_SECONDS", "300"))
+
+if WEBHOOK_BATCH_WINDOW_SECONDS and CELERY_BROKER_URL and not CACHE_URL:
+    # Web processes open batch windows and workers close them.
+    raise ImproperlyConfigured("WEBHOOK_BATCH_WINDOW_SECONDS needs CACHE_URL so processes share a cache.")
 
 UNFOLD = {
     "SITE_TITLE": "BotHub",
@@ -7,6 +7,7 @@ from .models import AuditEvent, Message, Project, ProjectMembership, Tag, Task,
 from .permissions import (
     CanEditProject,
     CanViewProject,
+    annotate_user_role,
     filter_by_project_membership,
     filter_projects_by_membership,
 )
@@ -76,6 +77,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         queryset = Project.objects.all().select_related("created_by")
+        queryset = annotate_user_role(queryset, self.request.user)
         return filter_projects_by_membership(queryset, self.request.user)
 
     def perform_create(self, serializer):
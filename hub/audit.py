@@ -1,4 +1,7 @@
+from functools import partial
+
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
 
 from .models import AuditEvent
 from .webhooks import dispatch_webhooks
@@ -17,4 +20,7 @@ def log_event(actor, verb, target=None, metadata=None):
         target_object_id=object_id,
         metadata=metadata or {},
     )
-    dispatch_webhooks(audit_event)
+    # Webhook delivery is network I/O; never hold a transaction open for it,
+    # and never announce writes that end up rolled back. robust=True keeps a
+    # dispatch failure from turning the already-committed write into a 500.
+    transaction.on_commit(partial(dispatch_webhooks, audit_event), robust=True)
@@ -12,9 +12,15 @@ class ProjectForm(forms.ModelForm):
 class TaskForm(forms.ModelForm):
     def __init__(self, *args, **kwargs):
         project = kwargs.pop("project", None)
+        parent_choices = kwargs.pop("parent_choices", None)
         super().__init__(*args, **kwargs)
         if project is not None:
             self.fields["parent"].queryset = Task.objects.filter(project=project)
+        if parent_choices is not None:
+            # Tasks already in hand (e.g. the cached task tree), so rendering
+            # the select runs no query. Validation still uses the queryset.
+            field = self.fields["parent"]
+            field.choices = [("", field.empty_label)] + [(task.pk, str(task)) for task in parent_choices]
 
     class Meta:
         model = Task
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.14 on 2026-10-15 09:12
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+
+
+def backfill_message_counts(apps, schema_editor):
+    """Set message_count from the messages each thread already has."""
+    Message = apps.get_model('hub', 'Message')
+    Thread = apps.get_model('hub', 'Thread')
+
+    counts = (
+        Message.objects.filter(thread=OuterRef('pk'))
+        .order_by()
+        .values('thread')
+        .annotate(count=Count('*'))
+        .values('count')
+    )
+    Thread.objects.filter(pk__in=Message.objects.values('thread')).update(message_count=Subquery(counts))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hub', '0004_merge_0002_webhook_0003_create_owner_memberships'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_message_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.14 on 2026-10-15 23:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hub', '0005_thread_message_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('audit_event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='hub.auditevent')),
+                ('webhook', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_events', to='hub.webhook')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pendingwebhookevent',
+            constraint=models.UniqueConstraint(fields=('webhook', 'audit_event'), name='unique_pending_webhook_event'),
+        ),
+    ]
@@ -2,7 +2,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import connections, models
 from django.db.models import Q
 from django.utils.text import slugify
 
@@ -83,6 +83,57 @@ class Tag(models.Model):
         return self.name
 
 
+# Sort key for one level of the task tree, per database vendor: the root
+# expression and how a child extends its parent's key. Keys compare as
+# (position, id) pairs, so ordering by the full key gives a depth-first walk.
+TASK_TREE_PATH_SQL = {
+    "postgresql": ("ARRAY[position, id]", "t.path || ARRAY[c.position, c.id]"),
+    "sqlite": (
+        "printf('%%020d%%020d', position, id)",
+        "t.path || printf('%%020d%%020d', c.position, c.id)",
+    ),
+}
+
+
+class TaskManager(models.Manager):
+    def tree_for_project(self, project_id, fields=None):
+        """
+        Return a project's tasks in depth-first order, each with a ``depth``.
+
+        A single recursive CTE walks the hierarchy so callers can nest the
+        rows in one pass. Tasks whose parent is outside the project are
+        treated as roots. ``fields`` limits the selected columns like
+        ``only()``; it must include "id".
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        root_path, child_path = TASK_TREE_PATH_SQL[connection.vendor]
+        if fields is None:
+            columns, child_columns = "*", "c.*"
+        else:
+            names = [connection.ops.quote_name(self.model._meta.get_field(f).column) for f in fields]
+            columns = ", ".join(names)
+            child_columns = ", ".join(f"c.{name}" for name in names)
+        return self.raw(
+            f"""
+            WITH RECURSIVE t AS (
+                SELECT {columns}, 0 AS depth, {root_path} AS path
+                FROM {table}
+                WHERE project_id = %s
+                    AND (parent_id IS NULL
+                         OR parent_id NOT IN (SELECT id FROM {table} WHERE project_id = %s))
+                UNION ALL
+                SELECT {child_columns}, t.depth + 1, {child_path}
+                FROM {table} c
+                JOIN t ON c.parent_id = t.id
+                WHERE c.project_id = %s
+            )
+            SELECT * FROM t ORDER BY path
+            """,
+            [project_id, project_id, project_id],
+        )
+
+
 class Task(models.Model):
     class Status(models.TextChoices):
         BACKLOG = "backlog", "Backlog"
@@ -114,6 +165,8 @@ class Task(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TaskManager()
+
     class Meta:
         ordering = ["project_id", "parent_id", "position", "id"]
 
@@ -167,6 +220,8 @@ class Thread(models.Model):
     created_by = models.ForeignKey(
         User, null=True, blank=True, on_delete=models.SET_NULL, related_name="threads_created"
     )
+    # Kept in step with the thread's messages by hub.signals.
+    message_count = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -189,6 +244,21 @@ class Thread(models.Model):
         if self.project_id and self.task_id:
             raise ValidationError("Thread can only attach to one scope.")
 
+    def save(self, *args, **kwargs) -> None:
+        # message_count is maintained with F() updates (see hub.signals); writing
+        # back the value loaded with this instance would undo concurrent ones.
+        if not self._state.adding and not kwargs.get("force_insert"):
+            update_fields = kwargs.get("update_fields")
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name
+                    for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs["update_fields"] = [name for name in update_fields if name != "message_count"]
+        super().save(*args, **kwargs)
+
     def __str__(self) -> str:
         return self.title
 
@@ -251,3 +321,19 @@ class AuditEvent(models.Model):
 
     def __str__(self) -> str:
         return f"{self.verb} ({self.created_at:%Y-%m-%d %H:%M})"
+
+
+class PendingWebhookEvent(models.Model):
+    """An audit event waiting for its webhook's next batched delivery."""
+
+    webhook = models.ForeignKey(Webhook, on_delete=models.CASCADE, related_name="pending_events")
+    audit_event = models.ForeignKey(AuditEvent, on_delete=models.CASCADE, related_name="+")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["webhook", "audit_event"], name="unique_pending_webhook_event"),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.webhook} <- {self.audit_event}"
@@ -4,9 +4,21 @@ Permission classes for row-level access control based on ProjectMembership.
 All resources (Projects, Tasks, Threads, Messages) are scoped by project membership,
 and users must have appropriate membership to access related resources.
 """
+from django.db.models import Exists, OuterRef, Subquery
 from rest_framework import permissions
 from .models import ProjectMembership, Project, Task, Thread
 
+# Role groups used by the checks below, built once at import time.
+EDIT_ROLES = (
+    ProjectMembership.Role.MEMBER,
+    ProjectMembership.Role.ADMIN,
+    ProjectMembership.Role.OWNER,
+)
+ADMIN_ROLES = (
+    ProjectMembership.Role.ADMIN,
+    ProjectMembership.Role.OWNER,
+)
+
 
 class HasProjectPermission(permissions.BasePermission):
     """
@@ -92,11 +104,7 @@ class CanEditProject(HasProjectPermission):
 
         role = self.get_user_role_in_project(request.user, project)
         # MEMBER+ can edit
-        return role in [
-            ProjectMembership.Role.MEMBER,
-            ProjectMembership.Role.ADMIN,
-            ProjectMembership.Role.OWNER,
-        ]
+        return role in EDIT_ROLES
 
 
 class CanAdminProject(HasProjectPermission):
@@ -115,10 +123,7 @@ class CanAdminProject(HasProjectPermission):
 
         role = self.get_user_role_in_project(request.user, project)
         # ADMIN+ can admin
-        return role in [
-            ProjectMembership.Role.ADMIN,
-            ProjectMembership.Role.OWNER,
-        ]
+        return role in ADMIN_ROLES
 
 
 class CanDeleteProject(HasProjectPermission):
@@ -162,11 +167,7 @@ class IsProjectMemberOrReadOnly(HasProjectPermission):
             return True
 
         # Write access for MEMBER+
-        return role in [
-            ProjectMembership.Role.MEMBER,
-            ProjectMembership.Role.ADMIN,
-            ProjectMembership.Role.OWNER,
-        ]
+        return role in EDIT_ROLES
 
 
 def user_can_access_project(user, project):
@@ -189,21 +190,62 @@ def user_can_edit_project(user, project):
     Helper function to check if a user can edit a project.
     Returns True if user has MEMBER+ role.
     """
+    if user.is_superuser:
+        return True
     role = user_can_access_project(user, project)
-    return role in [
-        ProjectMembership.Role.MEMBER,
-        ProjectMembership.Role.ADMIN,
-        ProjectMembership.Role.OWNER,
-    ]
+    return role in EDIT_ROLES
+
+
+def request_can_access_project(request, project):
+    """
+    Like user_can_access_project for request.user, but memoised on the request
+    so repeated checks against the same project only query memberships once.
+    """
+    roles = getattr(request, "_project_roles", None)
+    if roles is None:
+        roles = request._project_roles = {}
+    if project.pk not in roles:
+        if not request.user.is_superuser and hasattr(project, "user_role"):
+            # Already fetched alongside the project (see annotate_user_role).
+            roles[project.pk] = project.user_role
+        else:
+            roles[project.pk] = user_can_access_project(request.user, project)
+    return roles[project.pk]
+
+
+def request_can_edit_project(request, project):
+    """
+    Like user_can_edit_project for request.user, using the per-request role cache.
+    """
+    return request_can_access_project(request, project) in EDIT_ROLES
+
+
+def annotate_user_role(queryset, user):
+    """
+    Annotate a Project queryset with ``user_role``: the user's membership role,
+    or None if they are not a member. Lets role checks skip a separate query.
+    Superusers are never looked up, so their querysets are left as-is.
+    """
+    if user.is_superuser:
+        return queryset
+    return queryset.annotate(
+        user_role=Subquery(
+            ProjectMembership.objects.filter(project=OuterRef("pk"), user=user).values("role")[:1]
+        )
+    )
 
 
 def filter_projects_by_membership(queryset, user):
     """
     Filter a Project queryset to only include projects the user has access to.
+
+    Uses an EXISTS subquery rather than a join so no DISTINCT is needed.
     """
     if user.is_superuser:
         return queryset
-    return queryset.filter(memberships__user=user).distinct()
+    return queryset.filter(
+        Exists(ProjectMembership.objects.filter(project=OuterRef("pk"), user=user))
+    )
 
 
 def filter_by_project_membership(queryset, user, project_field='project'):
@@ -214,6 +256,7 @@ def filter_by_project_membership(queryset, user, project_field='project'):
     if user.is_superuser:
         return queryset
 
-    # Build the filter path to the project's memberships
-    filter_kwargs = {f'{project_field}__memberships__user': user}
-    return queryset.filter(**filter_kwargs).distinct()
+    # Correlate on the project path; EXISTS keeps rows unique without DISTINCT
+    return queryset.filter(
+        Exists(ProjectMembership.objects.filter(project=OuterRef(project_field), user=user))
+    )
@@ -66,6 +66,10 @@ class ProjectSerializer(serializers.ModelSerializer):
         if request.user.is_superuser:
             return ProjectMembership.Role.OWNER
 
+        if hasattr(obj, "user_role"):
+            # Annotated by ProjectViewSet.get_queryset
+            return obj.user_role
+
         try:
             membership = ProjectMembership.objects.get(project=obj, user=request.user)
             return membership.role
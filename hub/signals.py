@@ -1,8 +1,11 @@
 from django.contrib.auth import get_user_model
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
 
-from .models import UserProfile
+from .models import Message, Thread, UserProfile, Webhook
+from .webhooks import ACTIVE_WEBHOOKS_CACHE_KEY
 
 User = get_user_model()
 
@@ -11,3 +14,40 @@ User = get_user_model()
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
+
+
+@receiver(pre_save, sender=Message)
+def remember_message_thread(sender, instance, raw, **kwargs):
+    # Lets the post_save handler notice a message moving to another thread.
+    instance._previous_thread_id = None
+    if not raw and not instance._state.adding:
+        instance._previous_thread_id = (
+            Message.objects.filter(pk=instance.pk).values_list("thread_id", flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Message)
+def update_thread_on_message_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        # Fixtures carry each thread's message_count already.
+        return
+    moved_from = getattr(instance, "_previous_thread_id", None)
+    if moved_from == instance.thread_id:
+        moved_from = None
+    if created or moved_from is not None:
+        Thread.objects.filter(pk=instance.thread_id).update(message_count=F("message_count") + 1)
+    if moved_from is not None:
+        Thread.objects.filter(pk=moved_from, message_count__gt=0).update(message_count=F("message_count") - 1)
+
+
+@receiver(post_delete, sender=Message)
+def update_thread_on_message_delete(sender, instance, **kwargs):
+    Thread.objects.filter(pk=instance.thread_id, message_count__gt=0).update(
+        message_count=F("message_count") - 1
+    )
+
+
+@receiver(post_save, sender=Webhook)
+@receiver(post_delete, sender=Webhook)
+def clear_active_webhooks_cache(sender, **kwargs):
+    cache.delete(ACTIVE_WEBHOOKS_CACHE_KEY)
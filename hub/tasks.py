@@ -0,0 +1,95 @@
+import logging
+
+import requests
+from celery import shared_task
+from django.core.cache import cache
+
+from .models import PendingWebhookEvent, Webhook
+from .webhooks import (
+    batch_cache_key,
+    build_event_payload,
+    deliver_webhook,
+    encode_payload,
+    schedule_batch_flush,
+    sign_payload,
+)
+
+logger = logging.getLogger(__name__)
+
+# How long a successful delivery is remembered, so a redelivered task is skipped.
+# This only dedupes across worker processes when CACHE_URL names a shared cache;
+# receivers should still dedupe on X-BotHub-Delivery.
+DELIVERED_CACHE_SECONDS = 60 * 60
+
+
+def retry_failed_delivery(task, exc):
+    """
+    Raise ``task.retry()`` with backoff, or return if the delivery should be
+    given up on: client errors won't change on retry, eager runs (no broker
+    configured) should not block the request, and the last allowed retry has
+    been used. Returning lets the caller clean up; Celery's own give-up path
+    would re-raise ``exc`` instead.
+    """
+    logger.warning("Webhook delivery failed: %s", exc)
+    response = exc.response
+    if task.request.is_eager or (response is not None and response.status_code < 500):
+        return
+    if task.max_retries is not None and task.request.retries >= task.max_retries:
+        return
+    raise task.retry(exc=exc, countdown=2 ** task.request.retries)
+
+
+@shared_task(bind=True, max_retries=5)
+def deliver_webhook_task(self, webhook_id, body, signature=None, delivery_id=None):
+    delivered_key = f"hub:webhook-delivered:{webhook_id}:{delivery_id}" if delivery_id is not None else None
+    if delivered_key and cache.get(delivered_key):
+        return
+    webhook = Webhook.objects.filter(pk=webhook_id, is_active=True).first()
+    if webhook is None:
+        return
+    try:
+        deliver_webhook(webhook, body.encode("utf-8"), signature, delivery_id)
+    except requests.RequestException as exc:
+        retry_failed_delivery(self, exc)
+        return
+    if delivered_key:
+        cache.set(delivered_key, True, DELIVERED_CACHE_SECONDS)
+
+
+@shared_task(bind=True, max_retries=5)
+def deliver_webhook_batch_task(self, webhook_id):
+    """
+    POST the webhook's pending events as one JSON array, oldest first. Each
+    item keeps its own ``id`` for receivers to dedupe. Events stay pending
+    until the POST succeeds or is given up on, so a retry resends them along
+    with anything logged since.
+
+    The batch key stays held until the flush is done, retries included, so
+    events logged meanwhile wait for this flush rather than starting a
+    parallel one over the same rows.
+    """
+    key = batch_cache_key(webhook_id)
+    webhook = Webhook.objects.filter(pk=webhook_id, is_active=True).first()
+    if webhook is None:
+        PendingWebhookEvent.objects.filter(webhook_id=webhook_id).delete()
+        cache.delete(key)
+        return
+    pending = list(
+        PendingWebhookEvent.objects.filter(webhook=webhook)
+        .select_related("audit_event__actor", "audit_event__target_content_type")
+        .order_by("audit_event_id")
+    )
+    if pending:
+        body = encode_payload([build_event_payload(item.audit_event) for item in pending])
+        signature = sign_payload(webhook.secret, body) if webhook.secret else None
+        try:
+            deliver_webhook(webhook, body, signature)
+        except requests.RequestException as exc:
+            # Keep the key through the backoff, even if it has expired meanwhile.
+            cache.set(key, True, 2 ** self.request.retries + 60)
+            retry_failed_delivery(self, exc)
+        PendingWebhookEvent.objects.filter(pk__in=[item.pk for item in pending]).delete()
+    cache.delete(key)
+    # Events logged while the key was held found a flush already scheduled.
+    if PendingWebhookEvent.objects.filter(webhook=webhook).exists():
+        schedule_batch_flush(webhook)
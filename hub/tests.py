@@ -1,19 +1,55 @@
+import hashlib
+import hmac
+import json
+from unittest import mock
+
+import requests
+from celery.exceptions import Retry
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core import serializers
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from kombu.exceptions import OperationalError
 
-from .models import Project, Task, Thread
+from .audit import log_event
+from .forms import TaskForm
+from .models import AuditEvent, Message, PendingWebhookEvent, Project, ProjectMembership, Task, Thread, Webhook
+from .permissions import (
+    HasProjectPermission,
+    annotate_user_role,
+    filter_projects_by_membership,
+    request_can_access_project,
+    request_can_edit_project,
+)
 from .serializers import ThreadSerializer
+from .tasks import deliver_webhook_batch_task, deliver_webhook_task, retry_failed_delivery
+from . import views
+from .views import find_task_slot, get_project_tasks, get_task_tree, render_task_tree
+from .webhooks import dispatch_webhooks, get_active_webhooks, sign_payload
 
 User = get_user_model()
 
+# hub.urls isn't mounted by bothub.urls; view tests route through this module.
+urlpatterns = [path("", include("hub.urls"))]
 
-class ThreadModelValidationTests(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username="casey", password="testpass")
-        self.project = Project.objects.create(name="Project Alpha", created_by=self.user)
-        self.task = Task.objects.create(project=self.project, title="Task One", created_by=self.user)
 
+class ProjectFixtureTestCase(TestCase):
+    """Creates one user, project and task per class rather than per test."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="casey", password="testpass")
+        cls.project = Project.objects.create(name="Project Alpha", created_by=cls.user)
+        cls.task = Task.objects.create(project=cls.project, title="Task One", created_by=cls.user)
+
+
+class ThreadModelValidationTests(ProjectFixtureTestCase):
     def test_thread_requires_scope(self):
         thread = Thread(title="Needs scope")
         with self.assertRaises(ValidationError):
@@ -25,12 +61,7 @@ class ThreadModelValidationTests(TestCase):
             thread.clean()
 
 
-class ThreadSerializerValidationTests(TestCase):
-    def setUp(self):
-        self.user = User.objects.create_user(username="jules", password="testpass")
-        self.project = Project.objects.create(name="Project Beta", created_by=self.user)
-        self.task = Task.objects.create(project=self.project, title="Task Two", created_by=self.user)
-
+class ThreadSerializerValidationTests(ProjectFixtureTestCase):
     def test_thread_serializer_requires_scope(self):
         serializer = ThreadSerializer(data={"title": "No scope", "kind": "general"})
         self.assertFalse(serializer.is_valid())
@@ -44,3 +75,565 @@ class ThreadSerializerValidationTests(TestCase):
         self.assertFalse(serializer.is_valid())
         self.assertIn("project", serializer.errors)
         self.assertIn("task", serializer.errors)
+
+
+class ThreadMessageCountTests(ProjectFixtureTestCase):
+    def test_message_count_follows_creates_and_deletes(self):
+        thread = Thread.objects.create(title="Chatter", project=self.project)
+        first = Message.objects.create(thread=thread, body="One")
+        Message.objects.create(thread=thread, body="Two")
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 2)
+        first.delete()
+        thread.refresh_from_db()
+        self.assertEqual(thread.message_count, 1)
+
+    def test_thread_save_does_not_overwrite_message_count(self):
+        thread = Thread.objects.create(title="Chatter", project=self.project)
+        stale = Thread.objects.get(pk=thread.pk)
+        Message.objects.create(thread=thread, body="One")
+        stale.title = "Renamed"
+        stale.save()
+        thread.refresh_from_db()
+        self.assertEqual((thread.title, thread.message_count), ("Renamed", 1))
+
+    def test_new_message_leaves_thread_updated_at_alone(self):
+        thread = Thread.objects.create(title="Chatter", project=self.project)
+        Message.objects.create(thread=thread, body="One")
+        self.assertEqual(Thread.objects.get(pk=thread.pk).updated_at, thread.updated_at)
+
+    def test_loading_a_fixture_does_not_count_messages_twice(self):
+        thread = Thread.objects.create(title="Chatter", project=self.project)
+        Message.objects.create(thread=thread, body="One")
+        Message.objects.create(thread=thread, body="Two")
+        thread.refresh_from_db()
+        data = serializers.serialize("json", [thread, *thread.messages.all()])
+        Thread.objects.filter(pk=thread.pk).delete()
+        for obj in serializers.deserialize("json", data):
+            obj.save()
+        self.assertEqual(Thread.objects.get(pk=thread.pk).message_count, 2)
+
+    def test_moving_a_message_moves_its_count(self):
+        source = Thread.objects.create(title="Source", project=self.project)
+        target = Thread.objects.create(title="Target", project=self.project)
+        message = Message.objects.create(thread=source, body="One")
+        message.thread = target
+        message.save()
+        source.refresh_from_db()
+        target.refresh_from_db()
+        self.assertEqual((source.message_count, target.message_count), (0, 1))
+
+
+class GetProjectFromObjTests(SimpleTestCase):
+    """get_project_from_obj only reads attributes, so unsaved instances suffice."""
+
+    def test_resolves_project_for_each_model(self):
+        project = Project(id=1, name="Project Gamma")
+        task = Task(id=1, project=project, title="Task Three")
+        project_thread = Thread(id=1, title="On project", project=project)
+        task_thread = Thread(id=2, title="On task", task=task)
+        message = Message(id=1, thread=task_thread, body="Hi")
+        permission = HasProjectPermission()
+        for obj in (project, task, project_thread, task_thread, message):
+            with self.subTest(model=type(obj).__name__, id=obj.id):
+                self.assertIs(permission.get_project_from_obj(obj), project)
+
+
+class FilterProjectsByMembershipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="robin", password="testpass")
+        cls.other = User.objects.create_user(username="sam", password="testpass")
+        cls.mine, cls.shared, cls.theirs = Project.objects.bulk_create(
+            [Project(name="Mine"), Project(name="Shared"), Project(name="Theirs")]
+        )
+        ProjectMembership.objects.bulk_create(
+            [
+                ProjectMembership(project=cls.mine, user=cls.user, role=ProjectMembership.Role.OWNER),
+                ProjectMembership(project=cls.shared, user=cls.user, role=ProjectMembership.Role.VIEWER),
+                ProjectMembership(project=cls.shared, user=cls.other, role=ProjectMembership.Role.OWNER),
+                ProjectMembership(project=cls.theirs, user=cls.other, role=ProjectMembership.Role.OWNER),
+            ]
+        )
+
+    def test_only_member_projects_once_each(self):
+        with self.assertNumQueries(1):
+            projects = list(filter_projects_by_membership(Project.objects.order_by("name"), self.user))
+        self.assertEqual(projects, [self.mine, self.shared])
+
+    def test_request_role_checks_share_one_query(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertEqual(request_can_access_project(request, self.shared), ProjectMembership.Role.VIEWER)
+            self.assertFalse(request_can_edit_project(request, self.shared))
+
+    def test_annotated_role_needs_no_extra_query(self):
+        request = RequestFactory().get("/")
+        request.user = self.user
+        project = annotate_user_role(Project.objects.all(), self.user).get(pk=self.theirs.pk)
+        with self.assertNumQueries(0):
+            self.assertIsNone(request_can_access_project(request, project))
+
+    def test_superuser_sees_everything(self):
+        superuser = User(username="root", is_superuser=True)
+        projects = filter_projects_by_membership(Project.objects.all(), superuser)
+        self.assertEqual(projects.count(), 3)
+
+
+class TaskTreeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.project = Project.objects.create(name="Project Delta")
+        cls.second = Task.objects.create(project=cls.project, title="Second", position=2)
+        cls.first = Task.objects.create(project=cls.project, title="First", position=1)
+        cls.child_b = Task.objects.create(project=cls.project, parent=cls.first, title="Child B", position=5)
+        cls.child_a = Task.objects.create(project=cls.project, parent=cls.first, title="Child A", position=3)
+        cls.grandchild = Task.objects.create(project=cls.project, parent=cls.child_a, title="Grandchild")
+
+    def test_tasks_come_back_depth_first(self):
+        tasks = list(get_project_tasks(self.project))
+        self.assertEqual(
+            [(task.title, task.depth) for task in tasks],
+            [("First", 0), ("Child A", 1), ("Grandchild", 2), ("Child B", 1), ("Second", 0)],
+        )
+
+    def test_find_task_slot_places_new_tasks_depth_first(self):
+        new_id = 10**12  # newer than any existing row, as a freshly saved task is
+        tasks = list(get_project_tasks(self.project))
+        cases = [
+            (Task(id=new_id + 0, parent=None, position=0), (0, 0)),
+            (Task(id=new_id + 1, parent=None, position=1), (4, 0)),
+            (Task(id=new_id + 2, parent=None, position=9), (5, 0)),
+            (Task(id=new_id + 3, parent=self.first, position=4), (3, 1)),
+            (Task(id=new_id + 4, parent=self.child_a, position=0), (3, 2)),
+            (Task(id=new_id + 5, parent=self.second, position=0), (5, 1)),
+        ]
+        for task, slot in cases:
+            with self.subTest(task=task.id - new_id):
+                self.assertEqual(find_task_slot(tasks, task), slot)
+        self.assertIsNone(find_task_slot(tasks, Task(id=new_id + 6, parent_id=new_id + 99)))
+
+    def test_task_tree_is_cached_until_tasks_change(self):
+        cache.clear()
+        expected = [self.first, self.child_a, self.grandchild, self.child_b, self.second]
+        self.assertEqual(get_task_tree(self.project), expected)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_task_tree(self.project), expected)
+        third = Task.objects.create(project=self.project, title="Third", position=3)
+        self.assertEqual(get_task_tree(self.project), expected + [third])
+
+    def test_rendered_task_tree_is_cached_until_tasks_change(self):
+        cache.clear()
+        html = render_task_tree(self.project)
+        self.assertIn("Grandchild", html)
+        with self.assertNumQueries(1):
+            self.assertEqual(render_task_tree(self.project), html)
+        Task.objects.create(project=self.project, title="Fourth", position=4)
+        self.assertIn("Fourth", render_task_tree(self.project))
+
+    def test_fragment_and_task_list_share_one_tree_query(self):
+        cache.clear()
+        version = views.get_task_tree_version(self.project)
+        with CaptureQueriesContext(connection) as queries:
+            render_task_tree(self.project, version)
+            get_task_tree(self.project, version)
+        self.assertEqual(sum("RECURSIVE" in query["sql"].upper() for query in queries), 1)
+
+    def test_task_form_renders_parent_choices_without_a_query(self):
+        form = TaskForm(project=self.project, parent_choices=list(get_project_tasks(self.project)))
+        with self.assertNumQueries(0):
+            html = str(form["parent"])
+        self.assertIn("Grandchild", html)
+
+
+class ActiveWebhooksCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_active_webhooks_are_cached_until_a_webhook_changes(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_active_webhooks(), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_active_webhooks(), [])
+        webhook = Webhook.objects.create(url="https://example.com/hook", secret="s3cret", events=["task.created"])
+        self.assertEqual(get_active_webhooks(), [{"id": webhook.pk, "events": ["task.created"]}])
+        webhook.is_active = False
+        webhook.save()
+        self.assertEqual(get_active_webhooks(), [])
+
+
+class SignPayloadTests(SimpleTestCase):
+    def test_default_is_hmac_sha256(self):
+        expected = hmac.new(b"secret", b"{}", hashlib.sha256).hexdigest()
+        self.assertEqual(sign_payload("secret", b"{}"), expected)
+
+    @override_settings(WEBHOOK_SIGNATURE_ALG="blake2b")
+    def test_blake2b_is_keyed_with_the_secret(self):
+        expected = hashlib.blake2b(b"{}", key=b"secret", digest_size=32).hexdigest()
+        self.assertEqual(sign_payload("secret", b"{}"), expected)
+        # Over-long secrets are hashed down to a 64-byte key, as the README documents.
+        key = hashlib.blake2b(b"s" * 100).digest()
+        expected = hashlib.blake2b(b"{}", key=key, digest_size=32).hexdigest()
+        self.assertEqual(sign_payload("s" * 100, b"{}"), expected)
+
+
+@override_settings(ROOT_URLCONF="hub.tests")
+class TaskCreateViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="robin", password="testpass")
+        cls.project = Project.objects.create(name="Project Foxtrot")
+        ProjectMembership.objects.create(project=cls.project, user=cls.user, role=ProjectMembership.Role.MEMBER)
+        cls.first = Task.objects.create(project=cls.project, title="First", position=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def _create(self, **data):
+        data = {"title": "Next", "status": Task.Status.TODO, "priority": Task.Priority.MEDIUM, "position": 2, **data}
+        return self.client.post(
+            reverse("hub:task-create", args=[self.project.pk]), data, HTTP_HX_REQUEST="true"
+        )
+
+    def test_current_client_gets_the_new_row_out_of_band(self):
+        response = self._create(tree_version=views.get_task_tree_version(self.project))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("HX-Reswap", response)
+        html = response.content.decode()
+        self.assertIn(f'hx-swap-oob="afterend:#task-{self.first.pk}"', html)
+        self.assertIn(f'value="{views.get_task_tree_version(self.project)}"', html)
+
+    def test_stale_client_gets_the_whole_tree(self):
+        stale = views.get_task_tree_version(self.project)
+        Task.objects.create(project=self.project, title="Added elsewhere", position=5)
+        response = self._create(tree_version=stale)
+        self.assertEqual(response["HX-Reswap"], "innerHTML")
+        html = response.content.decode()
+        self.assertIn("Added elsewhere", html)
+        self.assertNotIn("hx-swap-oob", html)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False, WEBHOOK_BATCH_WINDOW_SECONDS=0)
+class WebhookDispatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="jordan", password="testpass")
+        cls.project = Project.objects.create(name="Project Golf")
+        cls.webhook = Webhook.objects.create(
+            url="https://example.com/hook", secret="s3cret", events=["project.updated"]
+        )
+        Webhook.objects.create(url="https://example.com/other", events=["task.created"])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_queues_one_signed_task_per_matching_webhook(self):
+        with mock.patch.object(deliver_webhook_task, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                log_event(self.user, "project.updated", self.project)
+        event = AuditEvent.objects.get()
+        apply_async.assert_called_once()
+        webhook_id, body, signature, delivery_id = apply_async.call_args.kwargs["args"]
+        self.assertEqual((webhook_id, delivery_id), (self.webhook.pk, event.pk))
+        self.assertEqual(signature, sign_payload("s3cret", body.encode("utf-8")))
+        self.assertEqual(apply_async.call_args.kwargs["queue"], "webhooks")
+
+    def test_webhook_deactivated_elsewhere_is_skipped_despite_the_cache(self):
+        get_active_webhooks()
+        # A queryset update sends no signal, like a save in another process.
+        Webhook.objects.filter(pk=self.webhook.pk).update(is_active=False)
+        with mock.patch.object(deliver_webhook_task, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                log_event(self.user, "project.updated", self.project)
+        apply_async.assert_not_called()
+
+    def test_broker_outage_is_logged_not_raised(self):
+        with mock.patch.object(deliver_webhook_task, "apply_async", side_effect=OperationalError("down")):
+            with self.assertLogs("hub.webhooks", "ERROR"):
+                with self.captureOnCommitCallbacks(execute=True):
+                    log_event(self.user, "project.updated", self.project)
+        self.assertEqual(AuditEvent.objects.count(), 1)
+
+
+def mock_webhook_post():
+    """Patch the pooled session so deliveries succeed without touching the network."""
+    patcher = mock.patch("hub.webhooks._session.post")
+    post = patcher.start()
+    response = post.return_value.__enter__.return_value
+    response.headers = {"Content-Length": "0"}
+    return patcher, post
+
+
+class DeliverWebhookTaskTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.webhook = Webhook.objects.create(url="https://example.com/hook", secret="s3cret")
+
+    def setUp(self):
+        cache.clear()
+        patcher, self.post = mock_webhook_post()
+        self.addCleanup(patcher.stop)
+
+    def test_delivery_headers(self):
+        deliver_webhook_task.apply(args=[self.webhook.pk, "{}", "abc", 7])
+        self.post.assert_called_once()
+        headers = self.post.call_args.kwargs["headers"]
+        self.assertEqual(headers["X-BotHub-Signature"], "abc")
+        self.assertEqual(headers["X-BotHub-Signature-Alg"], "sha256")
+        self.assertEqual(headers["X-BotHub-Delivery"], "7")
+        self.assertEqual(self.post.call_args.kwargs["data"], b"{}")
+
+    def test_redelivered_task_does_not_post_again(self):
+        deliver_webhook_task.apply(args=[self.webhook.pk, "{}", "abc", 7])
+        deliver_webhook_task.apply(args=[self.webhook.pk, "{}", "abc", 7])
+        self.assertEqual(self.post.call_count, 1)
+        deliver_webhook_task.apply(args=[self.webhook.pk, "{}", "abc", 8])
+        self.assertEqual(self.post.call_count, 2)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False, WEBHOOK_BATCH_WINDOW_SECONDS=0.5)
+class WebhookBatchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="morgan", password="testpass")
+        cls.project = Project.objects.create(name="Project Hotel")
+        cls.webhook = Webhook.objects.create(url="https://example.com/hook", secret="s3cret")
+
+    def setUp(self):
+        cache.clear()
+        patcher, self.post = mock_webhook_post()
+        self.addCleanup(patcher.stop)
+
+    def _log(self, verb):
+        with mock.patch.object(deliver_webhook_batch_task, "apply_async") as apply_async:
+            with self.captureOnCommitCallbacks(execute=True):
+                log_event(self.user, verb, self.project)
+        return apply_async
+
+    def _flush(self):
+        deliver_webhook_batch_task.apply(args=[self.webhook.pk])
+        return [item["event"] for item in json.loads(self.post.call_args.kwargs["data"])]
+
+    def test_events_in_one_window_are_posted_together(self):
+        first = self._log("project.updated")
+        first.assert_called_once_with(args=[self.webhook.pk], countdown=0.5, queue="webhooks")
+        self._log("project.archived").assert_not_called()
+        self.assertEqual(self._flush(), ["project.updated", "project.archived"])
+        self.assertFalse(PendingWebhookEvent.objects.exists())
+        self._log("project.restored").assert_called_once()
+
+    def test_event_committed_out_of_pk_order_is_still_delivered(self):
+        earlier = AuditEvent.objects.create(verb="project.updated")
+        later = AuditEvent.objects.create(verb="project.archived")
+        with mock.patch.object(deliver_webhook_batch_task, "apply_async"):
+            dispatch_webhooks(later)
+            self.assertEqual(self._flush(), ["project.archived"])
+            dispatch_webhooks(earlier)
+            self.assertEqual(self._flush(), ["project.updated"])
+
+    def test_failed_batch_keeps_its_events_pending(self):
+        self._log("project.updated")
+        self.post.side_effect = requests.ConnectionError("refused")
+        deliver_webhook_batch_task.apply(args=[self.webhook.pk])
+        # Eager runs give up instead of retrying, which drops the batch.
+        self.assertFalse(PendingWebhookEvent.objects.exists())
+        self._log("project.archived")
+        with mock.patch("hub.tasks.retry_failed_delivery", side_effect=RuntimeError("retry")):
+            deliver_webhook_batch_task.apply(args=[self.webhook.pk])
+        self.assertEqual(PendingWebhookEvent.objects.count(), 1)
+
+
+    def _run_as_worker(self, retries):
+        """Run the flush as a broker-delivered attempt number ``retries``."""
+        deliver_webhook_batch_task.push_request(retries=retries, is_eager=False)
+        try:
+            deliver_webhook_batch_task.run(self.webhook.pk)
+        finally:
+            deliver_webhook_batch_task.pop_request()
+
+    def test_window_stays_held_while_a_failed_flush_retries(self):
+        self._log("project.updated")
+        self.post.side_effect = requests.ConnectionError("refused")
+        with mock.patch.object(deliver_webhook_batch_task, "retry", return_value=Retry()):
+            with self.assertRaises(Retry):
+                self._run_as_worker(retries=0)
+        self._log("project.archived").assert_not_called()
+        self.assertEqual(PendingWebhookEvent.objects.count(), 2)
+
+    def test_events_logged_during_a_flush_get_a_follow_up_flush(self):
+        self._log("project.updated")
+
+        def log_during_post(*args, **kwargs):
+            dispatch_webhooks(AuditEvent.objects.create(verb="project.archived"))
+            return mock.DEFAULT
+
+        self.post.side_effect = log_during_post
+        with mock.patch.object(deliver_webhook_batch_task, "apply_async") as apply_async:
+            self.assertEqual(self._flush(), ["project.updated"])
+        apply_async.assert_called_once_with(args=[self.webhook.pk], countdown=0.5, queue="webhooks")
+        self.assertEqual(PendingWebhookEvent.objects.get().audit_event.verb, "project.archived")
+
+    def test_batch_is_dropped_once_retries_run_out(self):
+        self._log("project.updated")
+        self.post.side_effect = requests.ConnectionError("refused")
+        with mock.patch.object(deliver_webhook_batch_task, "retry") as retry:
+            self._run_as_worker(retries=deliver_webhook_batch_task.max_retries)
+        retry.assert_not_called()
+        self.assertFalse(PendingWebhookEvent.objects.exists())
+
+
+class RetryFailedDeliveryTests(SimpleTestCase):
+    def _task(self, retries=0, is_eager=False):
+        task = mock.Mock(max_retries=5)
+        task.request.retries = retries
+        task.request.is_eager = is_eager
+        task.retry.side_effect = lambda **kwargs: RuntimeError(kwargs["countdown"])
+        return task
+
+    def _error(self, status=None):
+        response = None
+        if status is not None:
+            response = requests.Response()
+            response.status_code = status
+        return requests.RequestException("failed", response=response)
+
+    def test_server_errors_and_timeouts_retry_with_backoff(self):
+        for exc in (self._error(503), self._error()):
+            with self.subTest(exc=exc), self.assertRaisesMessage(RuntimeError, "8"):
+                retry_failed_delivery(self._task(retries=3), exc)
+
+    def test_client_errors_and_eager_runs_give_up(self):
+        self.assertIsNone(retry_failed_delivery(self._task(), self._error(404)))
+        self.assertIsNone(retry_failed_delivery(self._task(is_eager=True), self._error(503)))
+
+    def test_last_retry_gives_up(self):
+        self.assertIsNone(retry_failed_delivery(self._task(retries=5), self._error(503)))
+
+
+class HubViewLoginRequiredTests(SimpleTestCase):
+    """Anonymous requests are redirected before any database access."""
+
+    def test_views_redirect_anonymous_users_to_login(self):
+        cases = [
+            (views.home, "get", {}),
+            (views.project_create, "post", {}),
+            (views.project_detail, "get", {"project_id": 1}),
+            (views.task_create, "post", {"project_id": 1}),
+            (views.thread_create, "post", {"project_id": 1}),
+            (views.thread_detail, "get", {"thread_id": 1}),
+            (views.message_create, "post", {"thread_id": 1}),
+        ]
+        factory = RequestFactory()
+        for view, method, kwargs in cases:
+            with self.subTest(view=view.__name__):
+                request = getattr(factory, method)("/")
+                request.user = AnonymousUser()
+                response = view(request, **kwargs)
+                self.assertEqual(response.status_code, 302)
+                self.assertTrue(response["Location"].startswith(settings.LOGIN_URL))
+
+
+@override_settings(ROOT_URLCONF="hub.tests")
+class ThreadDetailQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="alex", password="testpass")
+        cls.project = Project.objects.create(name="Project Echo")
+        ProjectMembership.objects.create(project=cls.project, user=cls.user, role=ProjectMembership.Role.MEMBER)
+        cls.thread = Thread.objects.create(title="Planning", project=cls.project, created_by=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("hub:thread-detail", args=[self.thread.pk]))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_messages(self):
+        Message.objects.create(thread=self.thread, body="First", created_by=self.user)
+        baseline = self._count_queries()
+        Message.objects.bulk_create(
+            [Message(thread=self.thread, body=f"Reply {i}", created_by=self.user) for i in range(5)]
+        )
+        self.assertEqual(self._count_queries(), baseline)
+
+    def test_unchanged_thread_is_answered_with_not_modified(self):
+        url = reverse("hub:thread-detail", args=[self.thread.pk])
+        # The first response sets the CSRF cookie, so it carries no ETag.
+        self.assertFalse(self.client.get(url).has_header("ETag"))
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        Message.objects.create(thread=self.thread, body="New", created_by=self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ROOT_URLCONF="hub.tests")
+class DetailPageQueryReuseTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="robin", password="testpass")
+        cls.project = Project.objects.create(name="Project Foxtrot")
+        ProjectMembership.objects.create(project=cls.project, user=cls.user, role=ProjectMembership.Role.MEMBER)
+        Task.objects.create(project=cls.project, title="Root")
+        cls.thread = Thread.objects.create(title="Planning", project=cls.project, created_by=cls.user)
+        Message.objects.create(thread=cls.thread, body="First", created_by=cls.user)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def _capture_sql(self, url):
+        # The first response sets the CSRF cookie, so the ETag is only computed after it.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header("ETag"))
+        return [query["sql"] for query in queries]
+
+    def assertRunsOnce(self, fragment, sql):
+        self.assertEqual(sum(fragment in query for query in sql), 1, sql)
+
+    def test_project_detail_reuses_etag_lookups(self):
+        sql = self._capture_sql(reverse("hub:project-detail", args=[self.project.pk]))
+        self.assertRunsOnce('WHERE "hub_project"."id" = ', sql)
+        self.assertRunsOnce('MAX("hub_task"."updated_at")', sql)
+
+    def test_thread_detail_reuses_etag_lookups(self):
+        sql = self._capture_sql(reverse("hub:thread-detail", args=[self.thread.pk]))
+        self.assertRunsOnce('WHERE "hub_thread"."id" = ', sql)
+
+
+@override_settings(ROOT_URLCONF="hub.tests")
+class HomeConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="sam", password="testpass")
+        cls.older = Project.objects.create(name="Older")
+        cls.newer = Project.objects.create(name="Newer")
+        cls.newest = Project.objects.create(name="Newest")
+        cls.membership = ProjectMembership.objects.create(
+            project=cls.newer, user=cls.user, role=ProjectMembership.Role.MEMBER
+        )
+        ProjectMembership.objects.create(project=cls.newest, user=cls.user, role=ProjectMembership.Role.MEMBER)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def test_swapping_memberships_changes_the_etag(self):
+        url = reverse("hub:home")
+        self.client.get(url)
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # Neither the project count nor the newest updated_at (Newest's) changes.
+        self.membership.delete()
+        ProjectMembership.objects.create(project=self.older, user=self.user, role=ProjectMembership.Role.MEMBER)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Older")
+        self.assertNotContains(response, "Newer<")
@@ -8,12 +8,16 @@ from hub.models import AuditEvent, Message, Project, Task, Thread
 
 
 class AdminDashboardTests(TestCase):
-    def setUp(self):
+    @classmethod
+    def setUpTestData(cls):
+        # One shared superuser for the class; force_login skips password hashing.
         User = get_user_model()
-        self.admin_user = User.objects.create_superuser(
-            username="admin", email="admin@example.com", password="pass"
-        )
-        self.client.login(username="admin", password="pass")
+        cls.admin_user = User(username="admin", email="admin@example.com", is_staff=True, is_superuser=True)
+        cls.admin_user.set_unusable_password()
+        cls.admin_user.save()
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
 
     def _build_data(self):
         project = Project.objects.create(name="Project One", created_by=self.admin_user)
@@ -40,19 +44,24 @@ class AdminDashboardTests(TestCase):
     def test_recent_lists_are_limited_to_eight(self):
         self._build_data()
 
-        for i in range(10):
-            AuditEvent.objects.create(actor=self.admin_user, verb=f"event-{i}")
+        AuditEvent.objects.bulk_create(
+            [AuditEvent(actor=self.admin_user, verb=f"event-{i}") for i in range(10)]
+        )
 
         ct = ContentType.objects.get_for_model(Project)
-        for i in range(10):
-            LogEntry.objects.log_action(
-                user_id=self.admin_user.pk,
-                content_type_id=ct.pk,
-                object_id="1",
-                object_repr=f"Project {i}",
-                action_flag=ADDITION,
-                change_message="created",
-            )
+        LogEntry.objects.bulk_create(
+            [
+                LogEntry(
+                    user_id=self.admin_user.pk,
+                    content_type_id=ct.pk,
+                    object_id="1",
+                    object_repr=f"Project {i}",
+                    action_flag=ADDITION,
+                    change_message="created",
+                )
+                for i in range(10)
+            ]
+        )
 
         resp = self.client.get(reverse("admin:index"))
         self.assertEqual(resp.status_code, 200)
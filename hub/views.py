@@ -1,36 +1,205 @@
+from hashlib import sha256
+
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.http import Http404, HttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from django_ratelimit.decorators import ratelimit
 
 from .audit import log_event
 from .forms import MessageForm, ProjectForm, TaskForm, ThreadForm
 from .models import Message, Project, ProjectMembership, Task, Thread
 from .permissions import (
+    annotate_user_role,
     filter_projects_by_membership,
-    user_can_access_project,
-    user_can_edit_project,
+    request_can_access_project,
+    request_can_edit_project,
 )
 
 
-def build_task_tree(tasks):
-    nodes = {task.id: {"task": task, "children": []} for task in tasks}
-    roots = []
-    for task in tasks:
-        node = nodes[task.id]
-        if task.parent_id and task.parent_id in nodes:
-            nodes[task.parent_id]["children"].append(node)
-        else:
-            roots.append(node)
-    return roots
+MESSAGE_PAGE_SIZE = 50
+
+# Columns read by task_tree.html; the rest of each row is left in the database.
+TASK_TREE_FIELDS = ("id", "project", "parent", "position", "title", "description", "status")
 
 
 def get_project_tasks(project):
-    return (
-        Task.objects.filter(project=project)
-        .select_related("parent")
-        .order_by("parent_id", "position", "id")
+    return Task.objects.tree_for_project(project.id, fields=TASK_TREE_FIELDS)
+
+
+def get_task_tree_version(project):
+    """
+    Return a cache key fragment that changes whenever the project's tasks do,
+    or "" if it has no tasks.
+
+    It is derived from the task count and newest updated_at, so adds, edits
+    and deletes all produce a new key without explicit invalidation.
+    """
+    state = Task.objects.filter(project=project).aggregate(count=Count("id"), changed=Max("updated_at"))
+    if not state["count"]:
+        return ""
+    return f"{project.pk}:{state['count']}:{state['changed'].isoformat()}"
+
+
+def get_task_tree(project, version=None):
+    """
+    Return the project's tasks depth-first (each with ``depth``), cached
+    until one of its tasks changes. task_tree.html indents by depth, so no
+    nested structure is built. Pass ``version`` if it's already been looked up.
+    """
+    if version is None:
+        version = get_task_tree_version(project)
+    if not version:
+        return []
+    timeout = getattr(settings, "TASK_TREE_CACHE_SECONDS", 300)
+    return cache.get_or_set(f"hub:task-list:{version}", lambda: list(get_project_tasks(project)), timeout)
+
+
+def render_task_tree(project, version=None):
+    """Return the rendered task_tree.html fragment, cached like get_task_tree."""
+    if version is None:
+        version = get_task_tree_version(project)
+    if not version:
+        return render_to_string("hub/partials/task_tree.html", {"task_tree": [], "version": version})
+    timeout = getattr(settings, "TASK_TREE_CACHE_SECONDS", 300)
+    return cache.get_or_set(
+        f"hub:task-tree-fragment:{version}",
+        lambda: render_to_string(
+            "hub/partials/task_tree.html", {"task_tree": get_task_tree(project, version), "version": version}
+        ),
+        timeout,
+    )
+
+
+def find_task_slot(tasks, task):
+    """
+    Return (index, depth) for inserting a new task into the depth-first
+    ``tasks`` list, or None if its parent is not in the list.
+    """
+    start, depth = 0, 0
+    if task.parent_id is not None:
+        for i, other in enumerate(tasks):
+            if other.pk == task.parent_id:
+                start, depth = i + 1, other.depth + 1
+                break
+        else:
+            return None
+    key = (task.position, task.pk)
+    index = start
+    for other in tasks[start:]:
+        # Stop at the end of the parent's subtree or at the first later sibling
+        if other.depth < depth or (other.depth == depth and (other.position, other.pk) > key):
+            break
+        index += 1
+    return index, depth
+
+
+def _memoised(request, attr, key, load):
+    """
+    Return load() once per request and key, so a view's ETag function and the
+    view itself share lookups instead of repeating them on every 200.
+    """
+    values = getattr(request, attr, None)
+    if values is None:
+        values = {}
+        setattr(request, attr, values)
+    if key not in values:
+        values[key] = load()
+    return values[key]
+
+
+def request_project(request, project_id):
+    """The project shown by project_detail, with the user's role, or None."""
+    def load():
+        projects = annotate_user_role(Project.objects.only("id", "name", "description", "updated_at"), request.user)
+        return projects.filter(pk=project_id).first()
+
+    return _memoised(request, "_projects", project_id, load)
+
+
+def request_thread(request, thread_id):
+    """The thread shown by thread_detail, with the project(s) it belongs to, or None."""
+    def load():
+        threads = Thread.objects.select_related("project", "task__project").only(
+            "id", "title", "kind", "updated_at", "project__id", "task__project__id"
+        )
+        return threads.filter(pk=thread_id).first()
+
+    return _memoised(request, "_threads", thread_id, load)
+
+
+def request_task_tree_version(request, project):
+    """get_task_tree_version, computed once per request."""
+    return _memoised(request, "_task_tree_versions", project.pk, lambda: get_task_tree_version(project))
+
+
+def page_etag(request, *parts):
+    """
+    Return an ETag for a page built from ``parts`` for this user. The CSRF
+    cookie is mixed in so a cached page never carries a stale form token.
+    Returns None before the client has a cookie: the response sets one, so
+    any tag on it would never match again.
+    """
+    csrf_cookie = request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+    if not csrf_cookie:
+        return None
+    raw = ":".join(str(part) for part in (request.user.pk, csrf_cookie, *parts))
+    return sha256(raw.encode("utf-8")).hexdigest()
+
+
+def home_etag(request):
+    projects = filter_projects_by_membership(Project.objects.all(), request.user)
+    state = projects.aggregate(count=Count("id"), changed=Max("updated_at"))
+    # Swapping one membership for another keeps the project count, and maybe
+    # the newest updated_at, but always changes the newest membership id.
+    memberships = ProjectMembership.objects.filter(user=request.user).aggregate(
+        count=Count("id"), newest=Max("id")
+    )
+    return page_etag(request, state["count"], state["changed"], memberships["count"], memberships["newest"])
+
+
+def project_detail_etag(request, project_id):
+    project = request_project(request, project_id)
+    if project is None:
+        return None
+    # message_count covers the per-thread badges, which change without touching updated_at.
+    threads = Thread.objects.filter(project=project).aggregate(
+        count=Count("id"), changed=Max("updated_at"), messages=Sum("message_count")
+    )
+    return page_etag(
+        request,
+        project.updated_at,
+        request_can_access_project(request, project),
+        request_task_tree_version(request, project),
+        threads["count"],
+        threads["changed"],
+        threads["messages"],
+    )
+
+
+def thread_detail_etag(request, thread_id):
+    thread = request_thread(request, thread_id)
+    if thread is None:
+        return None
+    project = thread.project or (thread.task.project if thread.task else None)
+    if project is None:
+        return None
+    messages = Message.objects.filter(thread_id=thread.pk).aggregate(count=Count("id"), newest=Max("id"))
+    # htmx requests for older pages get a fragment instead of the whole page.
+    return page_etag(
+        request,
+        thread.updated_at,
+        messages["count"],
+        messages["newest"],
+        request_can_access_project(request, project),
+        bool(request.htmx),
     )
 
 
@@ -44,8 +213,10 @@ def htmx_form_error(request, template_name, context, target_id):
 
 @login_required
 @ratelimit(key='user', rate='1000/h', method='GET')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=home_etag)
 def home(request):
-    projects = Project.objects.all().order_by("name")
+    projects = Project.objects.only("id", "name", "description", "is_archived").order_by("name")
     # Filter projects by membership
     projects = filter_projects_by_membership(projects, request.user)
     return render(
@@ -73,15 +244,17 @@ def project_create(request):
         )
     project = form.save(commit=False)
     project.created_by = request.user
-    project.save()
-    # Auto-create OWNER membership for project creator
-    ProjectMembership.objects.create(
-        project=project,
-        user=request.user,
-        role=ProjectMembership.Role.OWNER,
-        invited_by=request.user
-    )
-    log_event(project.created_by, "project.created", project)
+    # One transaction for the row, its membership and its audit event.
+    with transaction.atomic():
+        project.save()
+        # Auto-create OWNER membership for project creator
+        ProjectMembership.objects.create(
+            project=project,
+            user=request.user,
+            role=ProjectMembership.Role.OWNER,
+            invited_by=request.user
+        )
+        log_event(project.created_by, "project.created", project)
     if request.htmx:
         return render(request, "hub/partials/project_row.html", {"project": project})
     return redirect("hub:home")
@@ -89,16 +262,20 @@ def project_create(request):
 
 @login_required
 @ratelimit(key='user', rate='1000/h', method='GET')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=project_detail_etag)
 def project_detail(request, project_id):
-    project = get_object_or_404(Project, pk=project_id)
+    project = request_project(request, project_id)
+    if project is None:
+        raise Http404("No Project matches the given query.")
     # Check if user has access to this project
-    if not user_can_access_project(request.user, project):
+    if not request_can_access_project(request, project):
         raise PermissionDenied("You don't have access to this project.")
-    tasks = get_project_tasks(project)
-    task_tree = build_task_tree(tasks)
+    version = request_task_tree_version(request, project)
+    task_tree_html = render_task_tree(project, version)
     threads = (
         Thread.objects.filter(project=project)
-        .annotate(message_count=Count("messages"))
+        .only("id", "title", "kind", "message_count")
         .order_by("-updated_at")
     )
     return render(
@@ -106,9 +283,9 @@ def project_detail(request, project_id):
         "hub/project_detail.html",
         {
             "project": project,
-            "task_tree": task_tree,
+            "task_tree_html": task_tree_html,
             "threads": threads,
-            "task_form": TaskForm(project=project),
+            "task_form": TaskForm(project=project, parent_choices=get_task_tree(project, version)),
             "thread_form": ThreadForm(),
         },
     )
@@ -119,9 +296,9 @@ def project_detail(request, project_id):
 def task_create(request, project_id):
     if request.method != "POST":
         return redirect("hub:project-detail", project_id=project_id)
-    project = get_object_or_404(Project, pk=project_id)
+    project = get_object_or_404(annotate_user_role(Project.objects.only("id"), request.user), pk=project_id)
     # Check if user has permission to edit this project
-    if not user_can_edit_project(request.user, project):
+    if not request_can_edit_project(request, project):
         raise PermissionDenied("You don't have permission to create tasks in this project.")
     form = TaskForm(request.POST, project=project)
     if not form.is_valid():
@@ -131,18 +308,33 @@ def task_create(request, project_id):
             {"task_form": form, "project": project},
             "#task-form",
         )
+    # The tree as the client rendered it, or None if it has changed since
+    # (e.g. another user added a task) and the client needs a fresh copy.
+    tasks = None
+    if request.htmx:
+        version = get_task_tree_version(project)
+        if version and request.POST.get("tree_version") == version:
+            tasks = get_task_tree(project, version)
     task = form.save(commit=False)
     task.project = project
     task.created_by = request.user
-    task.save()
-    form.save_m2m()
-    log_event(task.created_by, "task.created", task)
+    with transaction.atomic():
+        task.save()
+        form.save_m2m()
+        log_event(task.created_by, "task.created", task)
     if request.htmx:
-        tasks = get_project_tasks(project)
+        slot = find_task_slot(tasks, task) if tasks else None
+        if slot is None:
+            response = HttpResponse(render_task_tree(project))
+            response["HX-Reswap"] = "innerHTML"
+            return response
+        # Insert just the new row out-of-band after its predecessor
+        index, task.depth = slot
+        oob = f"afterend:#task-{tasks[index - 1].pk}" if index else "afterbegin:#task-list"
         return render(
             request,
-            "hub/partials/task_tree.html",
-            {"task_tree": build_task_tree(tasks)},
+            "hub/partials/task_created.html",
+            {"task": task, "oob": oob, "version": get_task_tree_version(project)},
         )
     return redirect("hub:project-detail", project_id=project_id)
 
@@ -152,9 +344,9 @@ def task_create(request, project_id):
 def thread_create(request, project_id):
     if request.method != "POST":
         return redirect("hub:project-detail", project_id=project_id)
-    project = get_object_or_404(Project, pk=project_id)
+    project = get_object_or_404(annotate_user_role(Project.objects.only("id"), request.user), pk=project_id)
     # Check if user has permission to edit this project
-    if not user_can_edit_project(request.user, project):
+    if not request_can_edit_project(request, project):
         raise PermissionDenied("You don't have permission to create threads in this project.")
     form = ThreadForm(request.POST)
     if not form.is_valid():
@@ -167,18 +359,22 @@ def thread_create(request, project_id):
     thread = form.save(commit=False)
     thread.project = project
     thread.created_by = request.user
-    thread.save()
-    log_event(thread.created_by, "thread.created", thread)
+    with transaction.atomic():
+        thread.save()
+        log_event(thread.created_by, "thread.created", thread)
     if request.htmx:
-        thread.message_count = 0
         return render(request, "hub/partials/thread_row.html", {"thread": thread})
     return redirect("hub:project-detail", project_id=project_id)
 
 
 @login_required
 @ratelimit(key='user', rate='1000/h', method='GET')
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=thread_detail_etag)
 def thread_detail(request, thread_id):
-    thread = get_object_or_404(Thread, pk=thread_id)
+    thread = request_thread(request, thread_id)
+    if thread is None:
+        raise Http404("No Thread matches the given query.")
     # Check if user has access to this thread's project
     if thread.project is not None:
         target_project = thread.project
@@ -187,16 +383,31 @@ def thread_detail(request, thread_id):
     else:
         raise PermissionDenied("This thread is not associated with a project.")
 
-    if not user_can_access_project(request.user, target_project):
+    if not request_can_access_project(request, target_project):
         raise PermissionDenied("You don't have access to this project.")
 
-    messages = Message.objects.filter(thread=thread).select_related("created_by")
+    # message_row.html only reads Message columns, so no related rows are loaded.
+    messages = Message.objects.filter(thread=thread)
+    # Newest page first; ?before=<id> walks back through older pages.
+    before = request.GET.get("before", "")
+    if before.isdigit():
+        messages = messages.filter(pk__lt=int(before))
+    page = list(messages.order_by("-pk")[:MESSAGE_PAGE_SIZE + 1])
+    older_before = page[MESSAGE_PAGE_SIZE - 1].pk if len(page) > MESSAGE_PAGE_SIZE else None
+    page = page[:MESSAGE_PAGE_SIZE][::-1]
+    if request.htmx and before:
+        return render(
+            request,
+            "hub/partials/message_page.html",
+            {"thread": thread, "messages": page, "older_before": older_before},
+        )
     return render(
         request,
         "hub/thread_detail.html",
         {
             "thread": thread,
-            "messages": messages,
+            "messages": page,
+            "older_before": older_before,
             "message_form": MessageForm(),
         },
     )
@@ -207,7 +418,11 @@ def thread_detail(request, thread_id):
 def message_create(request, thread_id):
     if request.method != "POST":
         return redirect("hub:thread-detail", thread_id=thread_id)
-    thread = get_object_or_404(Thread, pk=thread_id)
+    # Only the ids are needed: the permission check and the form action.
+    thread = get_object_or_404(
+        Thread.objects.select_related("project", "task__project").only("id", "project__id", "task__project__id"),
+        pk=thread_id,
+    )
     # Check if user has permission to edit this thread's project
     if thread.project is not None:
         target_project = thread.project
@@ -216,7 +431,7 @@ def message_create(request, thread_id):
     else:
         raise PermissionDenied("This thread is not associated with a project.")
 
-    if not user_can_edit_project(request.user, target_project):
+    if not request_can_edit_project(request, target_project):
         raise PermissionDenied("You don't have permission to create messages in this thread.")
 
     form = MessageForm(request.POST)
@@ -232,8 +447,9 @@ def message_create(request, thread_id):
     message.created_by = request.user
     if not message.author_label:
         message.author_label = message.created_by.get_username()
-    message.save()
-    log_event(message.created_by, "message.created", message)
+    with transaction.atomic():
+        message.save()
+        log_event(message.created_by, "message.created", message)
     if request.htmx:
         return render(request, "hub/partials/message_row.html", {"message": message})
     return redirect("hub:thread-detail", thread_id=thread_id)
@@ -1,17 +1,51 @@
 import hmac
-import json
 import logging
 import time
-from hashlib import sha256
-from urllib.error import URLError
-from urllib.request import Request, urlopen
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b, sha256
 
+import orjson
+import requests
 from django.conf import settings
+from django.core.cache import cache
+from kombu.exceptions import OperationalError
+from requests.adapters import HTTPAdapter
 
-from .models import Webhook
+from .models import PendingWebhookEvent, Webhook
 
 logger = logging.getLogger(__name__)
 
+# One pooled session per process, so repeat deliveries to a host reuse the
+# TCP/TLS connection. Retries are the Celery task's job, not the adapter's.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# Response bodies up to this size are read and discarded so the connection
+# returns to the pool; larger ones are never read and their connection closes.
+DRAIN_RESPONSE_MAX_BYTES = 64 * 1024
+
+# Ids and event filters of active webhooks, cleared by hub.signals whenever a
+# Webhook is saved or deleted. Other processes only see the clear if CACHE_URL
+# points them at a shared cache; URLs and secrets are never cached.
+ACTIVE_WEBHOOKS_CACHE_KEY = "hub:webhooks:active"
+ACTIVE_WEBHOOKS_CACHE_SECONDS = 60
+
+
+def batch_cache_key(webhook_id):
+    """Held while a flush of the webhook's pending events is scheduled."""
+    return f"hub:webhook-batch:{webhook_id}"
+
+
+def get_active_webhooks():
+    """Return ``{"id", "events"}`` dicts for the active webhooks, from the cache."""
+    return cache.get_or_set(
+        ACTIVE_WEBHOOKS_CACHE_KEY,
+        lambda: list(Webhook.objects.filter(is_active=True).values("id", "events")),
+        ACTIVE_WEBHOOKS_CACHE_SECONDS,
+    )
+
 
 def build_event_payload(audit_event):
     actor = None
@@ -34,36 +68,151 @@ def build_event_payload(audit_event):
         "actor": actor,
         "target": target,
         "metadata": audit_event.metadata or {},
-        "created_at": audit_event.created_at.isoformat(),
+        "created_at": audit_event.created_at,
     }
 
 
+def encode_payload(payload):
+    """Encode a payload (or list of payloads) to JSON bytes; datetimes become ISO 8601."""
+    return orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+
+
+def signature_algorithm():
+    return getattr(settings, "WEBHOOK_SIGNATURE_ALG", "sha256")
+
+
 def sign_payload(secret, body):
-    return hmac.new(secret.encode("utf-8"), body, sha256).hexdigest()
+    """
+    HMAC-SHA256 of ``body`` by default. With WEBHOOK_SIGNATURE_ALG set to
+    "blake2b", a 32-byte keyed BLAKE2b instead; secrets longer than BLAKE2b's
+    64-byte key limit are first hashed down to 64 bytes with BLAKE2b.
+    """
+    key = secret.encode("utf-8")
+    if signature_algorithm() == "blake2b":
+        if len(key) > blake2b.MAX_KEY_SIZE:
+            key = blake2b(key).digest()
+        return blake2b(body, key=key, digest_size=32).hexdigest()
+    return hmac.new(key, body, sha256).hexdigest()
 
 
-def deliver_webhook(webhook, payload):
-    body = json.dumps(payload).encode("utf-8")
+def deliver_webhook(webhook, body, signature=None, delivery_id=None):
+    """
+    POST an already-encoded body; ``signature`` is its X-BotHub-Signature.
+    ``delivery_id`` is sent as X-BotHub-Delivery and stays the same across
+    retries, so receivers can drop repeats.
+    """
     headers = {"Content-Type": "application/json"}
-    if webhook.secret:
-        headers["X-BotHub-Signature"] = sign_payload(webhook.secret, body)
-    request = Request(webhook.url, data=body, headers=headers, method="POST")
+    if signature:
+        headers["X-BotHub-Signature"] = signature
+        headers["X-BotHub-Signature-Alg"] = signature_algorithm()
+    if delivery_id is not None:
+        headers["X-BotHub-Delivery"] = str(delivery_id)
     timeout = getattr(settings, "WEBHOOK_TIMEOUT_SECONDS", 5)
     started = time.time()
     try:
-        with urlopen(request, timeout=timeout) as response:
-            response.read()
-    except URLError as exc:
-        logger.warning("Webhook delivery failed: %s", exc)
+        # Only the status matters, so the body is streamed rather than buffered.
+        with _session.post(webhook.url, data=body, headers=headers, timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            length = response.headers.get("Content-Length", "")
+            if length.isdigit() and int(length) <= DRAIN_RESPONSE_MAX_BYTES:
+                response.content  # consumed, so closing returns the connection to the pool
     finally:
         elapsed = time.time() - started
         logger.debug("Webhook delivered in %.2fs to %s", elapsed, webhook.url)
 
 
+def deliver_webhooks_now(deliveries, body, delivery_id=None):
+    """
+    Deliver ``body`` to each (webhook, signature) pair concurrently and wait,
+    so the total time is the slowest endpoint rather than the sum. Failures
+    are logged, not raised.
+    """
+    def deliver(delivery):
+        webhook, signature = delivery
+        try:
+            deliver_webhook(webhook, body, signature, delivery_id)
+        except requests.RequestException as exc:
+            logger.warning("Webhook delivery failed: %s", exc)
+
+    max_workers = min(len(deliveries), getattr(settings, "WEBHOOK_MAX_CONCURRENCY", 8))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(deliver, deliveries))
+
+
+def queue_delivery(task, webhook, **options):
+    """
+    ``task.apply_async(**options)``, logging rather than raising when the
+    broker is unreachable: the write being announced has already committed.
+    """
+    try:
+        task.apply_async(**options)
+    except OperationalError:
+        logger.exception("Could not queue webhook delivery to %s", webhook.url)
+        return False
+    return True
+
+
+def schedule_batch_flush(webhook):
+    """
+    Queue a flush of the webhook's pending events unless one is already
+    scheduled or running: the first event in a window takes the batch key and
+    later ones ride along until the flush releases it.
+    """
+    from .tasks import deliver_webhook_batch_task
+
+    window = getattr(settings, "WEBHOOK_BATCH_WINDOW_SECONDS", 0)
+    queue = getattr(settings, "WEBHOOK_CELERY_QUEUE", "webhooks")
+    key = batch_cache_key(webhook.id)
+    if cache.add(key, True, int(window) + 60) and not queue_delivery(
+        deliver_webhook_batch_task, webhook, args=[webhook.id], countdown=window, queue=queue
+    ):
+        cache.delete(key)
+
+
 def dispatch_webhooks(audit_event):
-    payload = build_event_payload(audit_event)
-    for webhook in Webhook.objects.filter(is_active=True):
-        events = webhook.events or []
-        if events and audit_event.verb not in events:
-            continue
-        deliver_webhook(webhook, payload)
+    """
+    Queue one delivery task per matching webhook. Without a Celery broker,
+    deliver inline instead, fanning out concurrently. With a batch window
+    set, each webhook instead gets one batched POST per window.
+    """
+    from .tasks import deliver_webhook_task
+
+    subscribed = [
+        row["id"] for row in get_active_webhooks() if not row["events"] or audit_event.verb in row["events"]
+    ]
+    if not subscribed:
+        return
+    # The cached list may lag behind other processes; the database has the
+    # final say on whether each webhook is still active, and its URL and secret.
+    webhooks = list(Webhook.objects.filter(pk__in=subscribed, is_active=True).only("id", "url", "secret"))
+    if not webhooks:
+        return
+    eager = getattr(settings, "CELERY_TASK_ALWAYS_EAGER", False)
+    queue = getattr(settings, "WEBHOOK_CELERY_QUEUE", "webhooks")
+    window = getattr(settings, "WEBHOOK_BATCH_WINDOW_SECONDS", 0)
+    if window and not eager:
+        # Record what each webhook is owed, then make sure a flush is coming.
+        PendingWebhookEvent.objects.bulk_create(
+            [PendingWebhookEvent(webhook=webhook, audit_event=audit_event) for webhook in webhooks],
+            ignore_conflicts=True,
+        )
+        for webhook in webhooks:
+            schedule_batch_flush(webhook)
+        return
+    # Every subscriber gets the same bytes: encode once, sign once per secret.
+    body = encode_payload(build_event_payload(audit_event))
+    signatures = {}
+    deliveries = []
+    for webhook in webhooks:
+        signature = None
+        if webhook.secret:
+            signature = signatures.get(webhook.secret)
+            if signature is None:
+                signature = signatures[webhook.secret] = sign_payload(webhook.secret, body)
+        deliveries.append((webhook, signature))
+    if eager:
+        deliver_webhooks_now(deliveries, body, audit_event.pk)
+        return
+    text = body.decode("utf-8")
+    for webhook, signature in deliveries:
+        queue_delivery(deliver_webhook_task, webhook, args=[webhook.id, text, signature, audit_event.pk], queue=queue)